@@ -29,11 +29,25 @@ bl_info = {
 	'category': 'Import-Export'}
 
 import bpy
-from bpy.props import StringProperty, BoolProperty
+from bpy.props import StringProperty, BoolProperty, IntProperty, EnumProperty
 from bpy_extras.io_utils import ExportHelper, ImportHelper
 from bpy_extras.image_utils import load_image
 from struct import Struct
+import zlib
+import json
+import sys
+import lzma
+import numpy as np
 from os import path
+from mmap import mmap, ACCESS_READ
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor, Future
+from multiprocessing import get_context, get_all_start_methods
+from os import cpu_count, fstat, remove, replace, listdir
+from hashlib import sha1
+from tempfile import TemporaryFile
+from shutil import copyfileobj
+from threading import Lock
 from mathutils import Vector, Matrix
 
 def assign_image(obj, imagename, imagedir = None):
@@ -58,132 +72,189 @@ def assign_image(obj, imagename, imagedir = None):
 
 class joe_vertex:
 	bstruct = Struct('<fff')
+	dtype = np.dtype('<f4')
 
-	# read list of 3-tuples
+	# (num, 3) float32 view into buffer at offset, no copy
 	@staticmethod
-	def read(num, file):
-		values = []
-		for i in range(num):
-			data = file.read(joe_vertex.bstruct.size)
-			v = joe_vertex.bstruct.unpack(data)
-			values.append(v)
-		return values
+	def unpack_from(num, buffer, offset):
+		return np.frombuffer(buffer, joe_vertex.dtype, num * 3, offset).reshape(num, 3)
 
-	# write a list of 3-tuples
+	# pack list of 3-tuples or (num, 3) array into buffer, return end offset
 	@staticmethod
-	def write(values, file):
-		for v in values:
-			data = joe_vertex.bstruct.pack(v[0], v[1], v[2])
-			file.write(data)
+	def pack_into(values, buffer, offset):
+		values = np.asarray(values, np.float64).reshape(-1, 3)
+		np.frombuffer(buffer, joe_vertex.dtype, values.size, offset)[:] = values.ravel()
+		return offset + values.shape[0] * joe_vertex.bstruct.size
 
 
 class joe_texcoord:
 	bstruct = Struct('<ff')
+	dtype = np.dtype('<f4')
 
-	# read a list of 2-tuples
+	# (num, 2) float64 array from buffer at offset, flip v,
+	# the flip is exact in double so load and save round trip
 	@staticmethod
-	def read(num, file):
-		values = []
-		for i in range(num):
-			data = file.read(joe_texcoord.bstruct.size)
-			v = joe_texcoord.bstruct.unpack(data)
-			values.append((v[0], 1 - v[1]))
+	def unpack_from(num, buffer, offset):
+		values = np.frombuffer(buffer, joe_texcoord.dtype, num * 2, offset).reshape(num, 2).astype(np.float64)
+		values[:, 1] = 1 - values[:, 1]
 		return values
 
-	# write a list of 2-tuples
+	# pack list of 2-tuples or (num, 2) array into buffer, flip v, return end offset
 	@staticmethod
-	def write(values, file):
-		for v in values:
-			data = joe_texcoord.bstruct.pack(v[0], 1 - v[1])
-			file.write(data)
+	def pack_into(values, buffer, offset):
+		values = np.asarray(values, np.float64).reshape(-1, 2)
+		data = np.frombuffer(buffer, joe_texcoord.dtype, values.size, offset).reshape(-1, 2)
+		data[:, 0] = values[:, 0]
+		data[:, 1] = 1 - values[:, 1]
+		return offset + values.shape[0] * joe_texcoord.bstruct.size
 
 
+# face table rows: 3 vertex, 3 normal, 3 texcoord indices
 class joe_face:
-	__slots__ = 'vertex_index', 'normal_index', 'texture_index'
 	bstruct = Struct('<3h3h3h')
+	dtype = np.dtype('<i2')
 
-	def __init__(self):
-		self.vertex_index = (0, 0, 0)
-		self.normal_index = (0, 0, 0)
-		self.texture_index = (0, 0, 0)
-
-	def load (self, file):
-		data = file.read(joe_face.bstruct.size)
-		v = joe_face.bstruct.unpack(data)
-		self.vertex_index = (v[0], v[1], v[2])
-		self.normal_index = (v[3], v[4], v[5])
-		self.texture_index = (v[6], v[7], v[8])
-		return self
+	# (num, 9) int16 view into buffer at offset, no copy
+	@staticmethod
+	def unpack_from(num, buffer, offset):
+		return np.frombuffer(buffer, joe_face.dtype, num * 9, offset).reshape(num, 9)
 
-	def save(self, file):
-		data = joe_face.bstruct.pack(
-			self.vertex_index[0],self.vertex_index[1],self.vertex_index[2],
-			self.normal_index[0],self.normal_index[1],self.normal_index[2],
-			self.texture_index[0],self.texture_index[1],self.texture_index[2])
-		file.write(data)
+	# pack (num, 9) index array into buffer, return end offset
+	@staticmethod
+	def pack_into(faces, buffer, offset):
+		if len(faces) and (faces.max() > 32767 or faces.min() < -32768):
+			raise OverflowError('JOE face index out of int16 range')
+		np.frombuffer(buffer, joe_face.dtype, faces.size, offset)[:] = faces.ravel()
+		return offset + len(faces) * joe_face.bstruct.size
 
 
 class joe_frame:
 	__slots__ = 'num_vertices', 'num_normals', 'num_texcoords',\
-				'faces', 'verts', 'texcoords', 'normals'
+				'faces', 'verts', 'texcoords', 'normals', 'arrays'
 	bstruct = Struct('<3i')
 
 	def __init__(self):
 		self.num_vertices = 0
 		self.num_texcoords = 0
 		self.num_normals = 0
-		self.faces = []
+		self.faces = np.zeros((0, 9), np.int16)
 		self.verts = []
 		self.texcoords = []
 		self.normals = []
+		self.arrays = {}
 
-	def load(self, file):
+	# unpack frame including its face block from buffer, return end offset
+	def unpack_from(self, buffer, offset, num_faces):
+		self.faces = joe_face.unpack_from(num_faces, buffer, offset)
+		offset += num_faces * joe_face.bstruct.size
 		# header
-		data = file.read(joe_frame.bstruct.size)
-		v = joe_frame.bstruct.unpack(data)
+		v = joe_frame.bstruct.unpack_from(buffer, offset)
 		self.num_vertices = v[0]
 		self.num_texcoords = v[1]
 		self.num_normals = v[2]
+		offset += joe_frame.bstruct.size
 		# mesh data
-		self.verts = joe_vertex.read(self.num_vertices, file)
-		self.normals = joe_vertex.read(self.num_normals, file)
-		self.texcoords = joe_texcoord.read(self.num_texcoords, file)
-		return self
-
-	def save(self, file):
+		self.verts = joe_vertex.unpack_from(self.num_vertices, buffer, offset)
+		offset += self.num_vertices * joe_vertex.bstruct.size
+		self.normals = joe_vertex.unpack_from(self.num_normals, buffer, offset)
+		offset += self.num_normals * joe_vertex.bstruct.size
+		self.texcoords = joe_texcoord.unpack_from(self.num_texcoords, buffer, offset)
+		offset += self.num_texcoords * joe_texcoord.bstruct.size
+		return offset
+
+	# size of packed frame including its face block
+	def size(self):
+		return len(self.faces) * joe_face.bstruct.size + joe_frame.bstruct.size +\
+			(len(self.verts) + len(self.normals)) * joe_vertex.bstruct.size +\
+			len(self.texcoords) * joe_texcoord.bstruct.size
+
+	# pack frame including its face block into buffer, return end offset
+	def pack_into(self, buffer, offset):
+		offset = joe_face.pack_into(self.faces, buffer, offset)
 		# header
-		data = joe_frame.bstruct.pack(self.num_vertices, self.num_texcoords, self.num_normals)
-		file.write(data)
+		joe_frame.bstruct.pack_into(buffer, offset, self.num_vertices, self.num_texcoords, self.num_normals)
+		offset += joe_frame.bstruct.size
 		# mesh data
-		joe_vertex.write(self.verts, file)
-		joe_vertex.write(self.normals, file)
-		joe_texcoord.write(self.texcoords, file)
+		offset = joe_vertex.pack_into(self.verts, buffer, offset)
+		offset = joe_vertex.pack_into(self.normals, buffer, offset)
+		offset = joe_texcoord.pack_into(self.texcoords, buffer, offset)
+		return offset
 
 	def from_mesh(self, obj):
-		mesh = obj.data
-		if obj.matrix_world != Matrix.Identity(4):
-			mesh = obj.data.copy()
-			mesh.transform(obj.matrix_world)
+		return self.from_arrays(*joe_frame.extract(obj))
+
+	# per triangle corner positions, normals and uvs of a mesh object,
+	# the only part of the export touching blender data.
+	# world: bake the world transform, otherwise in object space
+	# mesh: mesh to read instead of the object data, an evaluated one
+	# material: only extract triangles of these material slot indices
+	@staticmethod
+	def extract(obj, world=True, mesh=None, material=None):
+		return joe_frame.extract_groups(obj, world, mesh, [material])[0]
+
+	# corner arrays of several material groups, see extract. the mesh is
+	# read once and its triangles are split between the groups
+	# groups: material slot indices of each group, None for all triangles
+	# indices: per triangle material indices if already read, see material_indices
+	@staticmethod
+	def extract_groups(obj, world, mesh, groups, indices=None):
+		if mesh is None:
+			mesh = obj.data
 		if not mesh.loop_triangles:
 			mesh.calc_loop_triangles()
-		normals = util.indexed_set()
-		vertices = util.indexed_set()
-		texcoords = util.indexed_set()
-		# get vertices and normals
-		mvertices = mesh.vertices
-		mtexcoords = mesh.uv_layers[0].data
-		for tri in mesh.loop_triangles:
-			f = joe_face()
-			f.vertex_index = tuple(vertices.get(mvertices[i].co) for i in tri.vertices)
-			if tri.use_smooth:
-				f.normal_index = tuple(normals.get(mvertices[i].normal) for i in tri.vertices)
-			else:
-				f.normal_index = (normals.get(tri.normal),) * 3
-			f.texture_index = tuple(texcoords.get(mtexcoords[i].uv) for i in tri.loops)
-			self.faces.append(f)
-		self.normals = normals.list
-		self.verts = vertices.list
-		self.texcoords = texcoords.list
+		tris = mesh.loop_triangles
+		corners = util.foreach_get(tris, 'vertices', np.int32, 3)
+		loops = util.foreach_get(tris, 'loops', np.int32, 3)
+		smooth = util.foreach_get(tris, 'use_smooth', bool)
+		tnormals = util.foreach_get(tris, 'normal', np.float32, 3)
+		if indices is None and any(group is not None for group in groups):
+			indices = joe_frame.material_indices(mesh)
+		co = util.foreach_get(mesh.vertices, 'co', np.float32, 3)
+		vnormals = util.foreach_get(mesh.vertices, 'normal', np.float32, 3)
+		uvs = util.foreach_get(mesh.uv_layers[0].data, 'uv', np.float32, 2)
+		# bake world transform into the arrays, the mesh itself is left untouched
+		if world and obj.matrix_world != Matrix.Identity(4):
+			matrix = np.array(obj.matrix_world)
+			co = util.transform(co, matrix)
+			vnormals = util.transform_normals(vnormals, matrix)
+			tnormals = util.transform_normals(tnormals, matrix)
+		arrays = []
+		for group in groups:
+			tri = slice(None) if group is None else np.flatnonzero(np.isin(indices, group))
+			gcorners = corners[tri].ravel()
+			positions = co[gcorners]
+			normals = joe_frame.corner_normals(vnormals, tnormals[tri], gcorners, smooth[tri])
+			texcoords = uvs[loops[tri].ravel()]
+			arrays.append((positions, normals, texcoords))
+		return arrays
+
+	# per triangle material index, clamped to the available material slots
+	@staticmethod
+	def material_indices(mesh):
+		if not mesh.loop_triangles:
+			mesh.calc_loop_triangles()
+		indices = util.foreach_get(mesh.loop_triangles, 'material_index', np.int32)
+		return np.minimum(indices, max(len(mesh.materials) - 1, 0))
+
+	# per corner normals, vertex normals of smooth triangles, face normals of flat ones
+	@staticmethod
+	def corner_normals(vnormals, tnormals, corners, smooth):
+		return np.where(np.repeat(smooth, 3)[:, None], vnormals[corners], np.repeat(tnormals, 3, axis=0))
+
+	# build frame from per corner arrays, filtering duplicates
+	def from_arrays(self, positions, cnormals, ctexcoords):
+		vertices, vi = util.unique_rows(positions)
+		normals, ni = util.unique_rows(cnormals)
+		texcoords, ti = util.unique_rows(ctexcoords)
+		# indices may exceed int16 until split
+		faces = np.empty((len(positions) // 3, 9), np.int32)
+		faces[:, 0:3] = vi.reshape(-1, 3)
+		faces[:, 3:6] = ni.reshape(-1, 3)
+		faces[:, 6:9] = ti.reshape(-1, 3)
+		self.faces = faces
+		self.normals = normals
+		self.verts = vertices
+		self.texcoords = texcoords
 		self.num_normals = len(self.normals)
 		self.num_texcoords = len(self.texcoords)
 		self.num_vertices = len(self.verts)
@@ -191,70 +262,122 @@ class joe_frame:
 
 	# remove faces consisting less then 3 vertices
 	def remove_degenerate_faces(self):
-		faces = []
-		for f in self.faces:
-			vi = f.vertex_index
-			if vi[0] != vi[1] and vi[1] != vi[2] and vi[0] != vi[2]:
-				faces.append(f)
-		self.faces = faces
+		vi = self.faces[:, 0:3]
+		keep = (vi[:, 0] != vi[:, 1]) & (vi[:, 1] != vi[:, 2]) & (vi[:, 0] != vi[:, 2])
+		self.faces = self.faces[keep]
 
-	# blender only supports one normal per vertex
+	# blender only supports one normal per vertex,
+	# a vertex is created for each distinct vertex, normal index pair.
+	# returns the original index of each new vertex
 	def duplicate_verts_with_multiple_normals(self):
-		face_vert = {}
-		verts = []
-		for f in self.faces:
-			vi = [0,0,0]
-			for i in range(3):
-				vn = f.vertex_index[i], f.normal_index[i]
-				if vn not in face_vert:
-					verts.append(self.verts[f.vertex_index[i]])
-					vi[i] = len(verts) - 1
-					face_vert[vn] = vi[i]
-				else:
-					vi[i] = face_vert[vn]
-			f.vertex_index = (*vi,)
-		self.verts = verts
-
-	def to_mesh(self, name):
-		# cleanup joe
-		self.remove_degenerate_faces()
-		self.duplicate_verts_with_multiple_normals()
+		pairs = np.stack((self.faces[:, 0:3].ravel(), self.faces[:, 3:6].ravel()), axis=1)
+		first, inverse = util.unique_index(pairs)
+		sources = pairs[first, 0].astype(np.int32)
+		# duplicated vertex indices may exceed int16
+		faces = np.array(self.faces, np.int32)
+		faces[:, 0:3] = inverse.reshape(-1, 3)
+		self.faces = faces
+		self.verts = np.asarray(self.verts, np.float32).reshape(-1, 3)[sources]
+		return sources
+
+	# copy with positions and normals transformed by a 4x4 matrix
+	def transformed(self, matrix):
+		if np.array_equal(matrix, np.identity(4)):
+			return self
+		frame = joe_frame()
+		frame.faces = self.faces
+		frame.verts = util.transform(np.asarray(self.verts).reshape(-1, 3), matrix)
+		frame.normals = util.transform_normals(np.asarray(self.normals).reshape(-1, 3), matrix)
+		frame.texcoords = self.texcoords
+		frame.num_vertices = self.num_vertices
+		frame.num_normals = self.num_normals
+		frame.num_texcoords = self.num_texcoords
+		return frame
+
+	# frame of a face range, only keeping the vertices, normals and texcoords it uses
+	def subset(self, start, end):
+		faces = self.faces[start:end]
+		frame = joe_frame()
+		frame.faces = np.empty(faces.shape, np.int32)
+		elements = []
+		for i, values in enumerate((self.verts, self.normals, self.texcoords)):
+			used, inverse = np.unique(faces[:, i * 3:i * 3 + 3], return_inverse=True)
+			frame.faces[:, i * 3:i * 3 + 3] = inverse.reshape(-1, 3)
+			elements.append(np.asarray(values)[used])
+		frame.verts, frame.normals, frame.texcoords = elements
+		frame.num_vertices = len(frame.verts)
+		frame.num_normals = len(frame.normals)
+		frame.num_texcoords = len(frame.texcoords)
+		return frame
+
+	# cleanup joe and flatten it into vertex, loop vertex index, loop uv,
+	# original vertex index and loop normal arrays.
+	# custom_normals keeps the shared vertices and returns the joe normals per loop,
+	# otherwise vertices are duplicated per normal and loop normals are None.
+	# touches no blender data so it may run in a worker thread
+	def mesh_arrays(self, custom_normals=False):
+		if custom_normals not in self.arrays:
+			# cleanup a shallow copy, keep joe itself intact
+			clean = joe_frame()
+			clean.faces = self.faces
+			clean.verts = self.verts
+			clean.remove_degenerate_faces()
+			lnormals = None
+			if custom_normals:
+				clean.verts = np.asarray(clean.verts, np.float32).reshape(-1, 3)
+				sources = np.arange(len(clean.verts), dtype=np.int32)
+				normals = np.asarray(self.normals, np.float32).reshape(-1, 3)
+				lnormals = normals[clean.faces[:, 3:6].ravel()]
+			else:
+				sources = clean.duplicate_verts_with_multiple_normals()
+			faces = clean.faces
+			verts = clean.verts
+			loops = faces[:, 0:3].ravel()
+			uvs = None
+			if self.num_texcoords > 0:
+				texcoords = np.asarray(self.texcoords, np.float32).reshape(-1, 2)
+				uvs = texcoords[faces[:, 6:9].ravel()]
+			self.arrays[custom_normals] = verts, loops, uvs, sources, lnormals
+		return self.arrays[custom_normals]
+
+	def to_mesh(self, name, custom_normals=False):
+		verts, loops, uvs, sources, lnormals = self.mesh_arrays(custom_normals)
+		num_faces = len(loops) // 3
 
 		# new mesh
 		mesh = bpy.data.meshes.new(name)
-		mesh.vertices.add(len(self.verts))
-		mesh.polygons.add(len(self.faces))
-		mesh.loops.add(len(self.faces) * 3)
-
-		# set vertices
-		for i, v in enumerate(self.verts):
-			mesh.vertices[i].co = v
+		mesh.vertices.add(len(verts))
+		mesh.polygons.add(num_faces)
+		mesh.loops.add(len(loops))
 
-		# set vertex normals
-		for f in self.faces:
-			for i in range(3):
-				mesh.vertices[f.vertex_index[i]].normal = self.normals[f.normal_index[i]]
+		# set vertices, vertex normals are recalculated by blender
+		mesh.vertices.foreach_set('co', verts.ravel())
 
 		# set faces
-		for i, f in enumerate(self.faces):
-			p = mesh.polygons[i]
-			p.loop_start = i * 3
-			p.loop_total = 3
-			p.use_smooth = True
-			for j in range(3):
-				mesh.loops[i * 3 + j].vertex_index = f.vertex_index[j]
+		mesh.polygons.foreach_set('loop_start', np.arange(0, len(loops), 3, dtype=np.int32))
+		mesh.polygons.foreach_set('loop_total', np.full(num_faces, 3, np.int32))
+		mesh.polygons.foreach_set('use_smooth', np.ones(num_faces, bool))
+		mesh.loops.foreach_set('vertex_index', loops.astype(np.int32))
 
 		# set texture coords
-		if self.num_texcoords > 0:
+		if uvs is not None:
 			uv_layer = mesh.uv_layers.new()
-			for i, f in enumerate(self.faces):
-				for j in range(3):
-					uv_layer.data[i * 3 + j].uv = self.texcoords[f.texture_index[j]]
+			uv_layer.data.foreach_set('uv', uvs.ravel())
 		else:
 			print("Warning! Mesh has no texture coordinates.")
 
 		mesh.validate()
-		mesh.update()
+		mesh.update(calc_edges=custom_normals)
+
+		# set loop normals, validate may have removed invalid faces
+		if lnormals is not None:
+			if len(mesh.loops) == len(lnormals):
+				# auto smooth is required before blender 4.1, gone since
+				if hasattr(mesh, 'use_auto_smooth'):
+					mesh.use_auto_smooth = True
+				mesh.normals_split_custom_set(lnormals)
+			else:
+				print('Warning! ' + name + ' custom normals not imported. Invalid faces removed.')
 
 		object = bpy.data.objects.new(name, mesh)
 		bpy.context.scene.collection.objects.link(object)
@@ -264,64 +387,274 @@ class joe_obj:
 	__slots__ = 'ident', 'version', 'num_faces', 'num_frames', 'frames'
 	bstruct = Struct('<4i')
 
+	magic = 844121161
+
 	def __init__(self):
-		self.ident = 844121161
+		self.ident = joe_obj.magic
 		self.version = 3
 		self.num_faces = 0
 		self.num_frames = 0
 		self.frames = []
 
 	def load(self, file):
+		return self.unpack_from(file.read())
+
+	# triangle, vertex, normal, texcoord (of first frame) and frame counts,
+	# byte size, read from headers only, seeking past the bulk data
+	@staticmethod
+	def scan(buffer, offset=0, length=None):
+		end = len(buffer) if length is None else offset + length
+		if offset + joe_obj.bstruct.size > end:
+			raise Exception('truncated joe header')
+		ident, version, num_faces, num_frames = joe_obj.bstruct.unpack_from(buffer, offset)
+		if ident != joe_obj.magic:
+			raise Exception('not a joe, bad ident ' + str(ident))
+		if num_faces < 0 or num_frames < 1:
+			raise Exception('bad joe header, faces ' + str(num_faces) + ' frames ' + str(num_frames))
+		info = {'triangles': num_faces, 'frames': num_frames}
+		pos = offset + joe_obj.bstruct.size
+		for i in range(num_frames):
+			pos += num_faces * joe_face.bstruct.size
+			if pos + joe_frame.bstruct.size > end:
+				raise Exception('truncated joe frame ' + str(i))
+			num_vertices, num_texcoords, num_normals = joe_frame.bstruct.unpack_from(buffer, pos)
+			if min(num_vertices, num_texcoords, num_normals) < 0:
+				raise Exception('bad joe frame ' + str(i) + ' header')
+			pos += joe_frame.bstruct.size +\
+				(num_vertices + num_normals) * joe_vertex.bstruct.size +\
+				num_texcoords * joe_texcoord.bstruct.size
+			if pos > end:
+				raise Exception('truncated joe frame ' + str(i))
+			if i == 0:
+				info['vertices'] = num_vertices
+				info['normals'] = num_normals
+				info['texcoords'] = num_texcoords
+		info['bytes'] = pos - offset
+		return info
+
+	# decode from a bytes-like buffer, float and index blocks are views into it
+	def unpack_from(self, buffer, offset=0):
 		# header
-		data = file.read(joe_obj.bstruct.size)
-		v = joe_obj.bstruct.unpack(data)
+		v = joe_obj.bstruct.unpack_from(buffer, offset)
 		self.ident = v[0]
 		self.version = v[1]
 		self.num_faces = v[2]
 		self.num_frames = v[3]
+		offset += joe_obj.bstruct.size
 		# frames
 		for i in range(self.num_frames):
-			self.frames.append(joe_frame())
-			for j in range(self.num_faces):
-				self.frames[i].faces.append(joe_face().load(file))
-			self.frames[i].load(file)
+			frame = joe_frame()
+			offset = frame.unpack_from(buffer, offset, self.num_faces)
+			self.frames.append(frame)
 		return self
 
-	def save(self, file):
+	# pack whole object into a single preallocated buffer
+	def encode(self):
+		size = joe_obj.bstruct.size
+		for i in range(self.num_frames):
+			size += self.frames[i].size()
+		buffer = bytearray(size)
 		# header
-		data = joe_obj.bstruct.pack(self.ident, self.version, self.num_faces, self.num_frames)
-		file.write(data)
+		joe_obj.bstruct.pack_into(buffer, 0, self.ident, self.version, self.num_faces, self.num_frames)
+		offset = joe_obj.bstruct.size
 		# frames
 		for i in range(self.num_frames):
-			for j in range(self.num_faces):
-				self.frames[i].faces[j].save(file)
-			self.frames[i].save(file)
+			offset = self.frames[i].pack_into(buffer, offset)
+		return buffer
+
+	def save(self, file):
+		file.write(self.encode())
 
-	def to_mesh(self, name, num_frames=1):
+	# one mesh from the first frame, following frames become shape keys,
+	# each one fully applied at its scene frame
+	def to_mesh(self, name, num_frames=None, custom_normals=False):
 		if name.endswith('.joe'):
 			name = name[:-4]
-		frames = [None] * num_frames
-		for i in range(num_frames-1, -1, -1):
-			if num_frames > 1:
-				bpy.context.scene.frame_set(i)
-			frames[i] = self.frames[i].to_mesh(name)
-		return frames[0]
+		if num_frames is None:
+			num_frames = self.num_frames
+		obj = self.frames[0].to_mesh(name, custom_normals)
+		if num_frames > 1:
+			sources = self.frames[0].mesh_arrays(custom_normals)[3]
+			obj.shape_key_add(name='Basis', from_mix=False)
+			for i in range(1, num_frames):
+				verts = np.asarray(self.frames[i].verts, np.float32).reshape(-1, 3)
+				if len(verts) != self.frames[0].num_vertices or\
+					not np.array_equal(self.frames[i].faces, self.frames[0].faces):
+					print(name + ' frame ' + str(i) + ' not imported. Topology differs.')
+					continue
+				key = obj.shape_key_add(name='frame ' + str(i), from_mix=False)
+				key.data.foreach_set('co', verts[sources].ravel())
+				for frame, value in ((i - 1, 0.0), (i, 1.0), (i + 1, 0.0)):
+					key.value = value
+					key.keyframe_insert('value', frame=frame)
+		return obj
 
 	def from_mesh(self, mesh_obj, num_frames=1):
-		self.frames = [None] * num_frames
+		return self.from_arrays(joe_obj.extract(mesh_obj, num_frames))
+
+	# per frame corner arrays, see joe_frame.extract.
+	# for animations topology and uvs are extracted once,
+	# positions and normals are sampled per frame from the evaluated mesh
+	@staticmethod
+	def extract(mesh_obj, num_frames=1):
+		if num_frames == 1:
+			return [joe_frame.extract(mesh_obj)]
+		mesh = mesh_obj.data
+		if not mesh.loop_triangles:
+			mesh.calc_loop_triangles()
+		tris = mesh.loop_triangles
+		corners = util.foreach_get(tris, 'vertices', np.int32, 3).ravel()
+		loops = util.foreach_get(tris, 'loops', np.int32, 3).ravel()
+		smooth = util.foreach_get(tris, 'use_smooth', bool)
+		texcoords = util.foreach_get(mesh.uv_layers[0].data, 'uv', np.float32, 2)[loops]
+		depsgraph = bpy.context.evaluated_depsgraph_get()
+		frames = [None] * num_frames
 		for i in range(num_frames-1, -1, -1):
-			if num_frames > 1:
-				bpy.context.scene.frame_set(i)
-			self.frames[i] = joe_frame()
-			self.frames[i].from_mesh(mesh_obj)
-		self.num_frames = num_frames
+			bpy.context.scene.frame_set(i)
+			eval_obj = mesh_obj.evaluated_get(depsgraph)
+			eval_mesh = eval_obj.to_mesh()
+			eval_mesh.calc_loop_triangles()
+			if len(eval_mesh.vertices) != len(mesh.vertices) or\
+				len(eval_mesh.loop_triangles) != len(tris):
+				eval_obj.to_mesh_clear()
+				raise Exception(mesh_obj.name + ' vertex or triangle count changes at frame ' + str(i))
+			co = util.foreach_get(eval_mesh.vertices, 'co', np.float32, 3)
+			vnormals = util.foreach_get(eval_mesh.vertices, 'normal', np.float32, 3)
+			tnormals = util.foreach_get(eval_mesh.loop_triangles, 'normal', np.float32, 3)
+			matrix = np.array(eval_obj.matrix_world)
+			eval_obj.to_mesh_clear()
+			co = util.transform(co, matrix)
+			vnormals = util.transform_normals(vnormals, matrix)
+			tnormals = util.transform_normals(tnormals, matrix)
+			positions = co[corners]
+			normals = joe_frame.corner_normals(vnormals, tnormals, corners, smooth)
+			frames[i] = positions, normals, texcoords
+		return frames
+
+	# split into joes whose face indices fit into int16, all frames are split
+	# at the face ranges of the first one
+	def split(self, limit=32767):
+		if max(frame.faces.max(initial=0) for frame in self.frames) <= limit:
+			return [self]
+		joes = []
+		for start, end in util.split_ranges(self.frames[0].faces, limit):
+			joe = joe_obj()
+			joe.frames = [frame.subset(start, end) for frame in self.frames]
+			joe.num_frames = self.num_frames
+			joe.num_faces = end - start
+			joes.append(joe)
+		return joes
+
+	# frames share one face table, so for animations vertices and normals
+	# are filtered for duplicates across all frames at once
+	def from_arrays(self, frames):
+		if len(frames) == 1:
+			self.frames = [joe_frame().from_arrays(*frames[0])]
+		else:
+			positions = np.hstack([arrays[0] for arrays in frames])
+			normals = np.hstack([arrays[1] for arrays in frames])
+			merged = joe_frame().from_arrays(positions, normals, frames[0][2])
+			self.frames = []
+			for i in range(len(frames)):
+				frame = joe_frame()
+				frame.faces = merged.faces
+				frame.verts = merged.verts[:, i * 3:i * 3 + 3]
+				frame.normals = merged.normals[:, i * 3:i * 3 + 3]
+				frame.texcoords = merged.texcoords
+				frame.num_vertices = merged.num_vertices
+				frame.num_normals = merged.num_normals
+				frame.num_texcoords = merged.num_texcoords
+				self.frames.append(frame)
+		self.num_frames = len(self.frames)
 		self.num_faces = len(self.frames[0].faces)
 		return self
 
 
+# encode per frame corner arrays into a list of joe bytes, more than one
+# if the object has to be split, runs in worker processes
+def encode_joe(frames):
+	return [joe.encode() for joe in joe_obj().from_arrays(frames).split()]
+
+
+# filter and split object space corner arrays of a shared mesh,
+# runs in worker processes
+def filter_joe(arrays):
+	return joe_obj().from_arrays([arrays]).split()
+
+
+# encode the filtered and split object space joes of a shared mesh placed
+# by a world matrix, see encode_joe. vectorized and cheaper than sending
+# the joes to a worker, so it runs on the main thread
+def encode_instance(joes, matrix):
+	payloads = []
+	for joe in joes:
+		instance = joe_obj()
+		instance.frames = [frame.transformed(matrix) for frame in joe.frames]
+		instance.num_frames = joe.num_frames
+		instance.num_faces = joe.num_faces
+		payloads.append(instance.encode())
+	return payloads
+
+
+# depsgraph instance to export, stands in for the object in joe_pack.joe.
+# data: key of the source geometry, shared by all its instances
+# arrays: object space corner arrays of the source geometry, see joe_frame.extract
+class joe_instance:
+	__slots__ = 'data', 'matrix_world', 'arrays'
+
+	def __init__(self, data, matrix_world, arrays):
+		self.data = data
+		self.matrix_world = matrix_world
+		self.arrays = arrays
+
+
+# meshes to export per object, with evaluated set these are the
+# evaluated meshes of objects with modifiers or shape keys. they are
+# created on first use, kept for the duration of an export and freed
+# together by clear, as are the material indices read from them
+class joe_mesh_cache:
+	def __init__(self, evaluated=False):
+		self.evaluated = evaluated
+		self.depsgraph = None
+		self.objects = {}
+		self.indices = {}
+
+	# mesh to export of an object, the source key of an instance
+	def get(self, obj):
+		if isinstance(obj, joe_instance):
+			return obj.data
+		if not self.evaluated or not (obj.modifiers or obj.data.shape_keys):
+			return obj.data
+		if obj not in self.objects:
+			if self.depsgraph is None:
+				self.depsgraph = bpy.context.evaluated_depsgraph_get()
+			eval_obj = obj.evaluated_get(self.depsgraph)
+			self.objects[obj] = eval_obj, eval_obj.to_mesh()
+		return self.objects[obj][1]
+
+	# per triangle material indices of a mesh, see joe_frame.material_indices
+	def material_indices(self, mesh):
+		if mesh not in self.indices:
+			self.indices[mesh] = joe_frame.material_indices(mesh)
+		return self.indices[mesh]
+
+	def clear(self):
+		for eval_obj, mesh in self.objects.values():
+			eval_obj.to_mesh_clear()
+		self.objects.clear()
+		self.indices.clear()
+		self.depsgraph = None
+
+
 class joe_pack:
 	version = b'JPK01.00'
 	bstruct = Struct('<2i')
+	# compressed variant, the header adds a compression method,
+	# fat entries add the uncompressed payload length
+	zversion = b'JPZ01.00'
+	zstruct = Struct('<3i')
+	compressions = {'ZLIB': 1, 'LZMA': 2}
+	compressors = {1: zlib, 2: lzma}
 
 	def __init__(self):
 		self.numobjs = 0
@@ -330,9 +663,69 @@ class joe_pack:
 		self.list = {}
 		self.surfaces = []
 		self.dirname = None
+		self.meshes = joe_mesh_cache()
+		# material slot indices of entries holding one material of a mesh
+		self.materials = {}
 
+	# (name, joe_obj.scan info) of a jpk, a joe file or a directory of joe files,
+	# raises on the first truncated or corrupt object
+	@staticmethod
+	def scan(filename):
+		if path.isdir(filename):
+			dir = filename
+			filenames = sorted(name for name in listdir(dir) if name.endswith('.joe'))
+		elif filename.endswith('.joe'):
+			dir, filename = path.split(filename)
+			filenames = [filename]
+		else:
+			# compressed entries have to be inflated, plain ones are only touched at the headers
+			index = joe_pack_index(filename)
+			infos = []
+			for name in index.names:
+				try:
+					if index.method:
+						info = joe_obj.scan(index.payload(name))
+					else:
+						info = joe_obj.scan(index.buffer, index.offset(name), index.length(name))
+					# the entry has to hold exactly one joe
+					if info['bytes'] != index.rawlength(name):
+						raise Exception('joe of ' + str(info['bytes']) + ' bytes in entry of ' + str(index.rawlength(name)))
+				except Exception as e:
+					raise Exception(filename + ' ' + name + ': ' + str(e))
+				info['stored'] = index.length(name)
+				infos.append((name, info))
+			return infos
+		infos = []
+		for name in filenames:
+			with open(path.join(dir, name), 'rb') as file:
+				try:
+					info = joe_obj.scan(mmap(file.fileno(), 0, access=ACCESS_READ))
+					size = fstat(file.fileno()).st_size
+					if info['bytes'] != size:
+						raise Exception('joe of ' + str(info['bytes']) + ' bytes in file of ' + str(size))
+				except Exception as e:
+					raise Exception(path.join(dir, name) + ': ' + str(e))
+			info['stored'] = info['bytes']
+			infos.append((name, info))
+		return infos
+
+	# scan as text table with totals
+	@staticmethod
+	def scan_report(filename):
+		columns = 'triangles', 'vertices', 'normals', 'texcoords', 'frames', 'bytes', 'stored'
+		infos = joe_pack.scan(filename)
+		width = max([len(name) for name, info in infos] + [len('total')])
+		lines = [filename, 'object'.ljust(width) + ''.join(c.rjust(11) for c in columns)]
+		for name, info in infos:
+			lines.append(name.ljust(width) + ''.join(str(info[c]).rjust(11) for c in columns))
+		totals = [sum(info[c] for name, info in infos) for c in columns]
+		lines.append('total'.ljust(width) + ''.join(str(t).rjust(11) for t in totals))
+		return '\n'.join(lines)
+
+	# names: optional subset of objects to load
+	# custom_normals: prepare objects for import with custom split normals
 	@staticmethod
-	def read(filename):
+	def read(filename, names=None, workers=0, custom_normals=False):
 		# don't change call order
 		jpk = joe_pack()
 		jpk.load_list(filename)
@@ -340,33 +733,46 @@ class joe_pack:
 			if not filename.endswith('.jpk'):
 				dir = path.dirname(filename)
 				filename = path.join(dir, 'objects.jpk')
-			jpk.load(filename)
+			jpk.load(filename, names, workers, custom_normals)
 		except:
-			jpk.load_joes(filename)
+			jpk.load_joes(filename, names)
 		return jpk
 
 
+	# compression: None for plain jpk as read by the game, 'ZLIB' or 'LZMA'
+	# alignment: byte boundary objects start at
+	# dedup: store identical objects once
+	# incremental: only encode objects changed since the last incremental export
+	# instances: also export collection and geometry nodes instances
+	# evaluated: export meshes with modifiers applied
 	@staticmethod
-	def write(filename, write_list, write_jpk):
-		jpk = joe_pack().from_mesh()
-		if write_jpk:
-			jpk.save(filename)
-		if write_list:
-			jpk.save_list(filename)
-
-	def to_mesh(self):
+	def write(filename, write_list, write_jpk, workers=1, compression=None, alignment=1, dedup=False, incremental=False, instances=False, evaluated=False):
+		jpk = joe_pack()
+		try:
+			jpk.from_mesh(instances, evaluated)
+			if write_jpk:
+				jpk.save(filename, workers, compression, alignment, dedup, incremental)
+			if write_list:
+				jpk.save_list(filename)
+		finally:
+			jpk.meshes.clear()
+
+	def to_mesh(self, custom_normals=False):
 		trackobject.create_groups()
 		for name, joe in self.joe.items():
 			trackobj = self.list.get(name)
 			if trackobj:
-				obj = joe.to_mesh(name)
+				obj = joe.to_mesh(name, custom_normals=custom_normals)
 				imagename = trackobj.values[1]
 				assign_image(obj, imagename, self.dirname)
 				trackobj.to_obj(obj)
 			else:
 				print(name + ' not imported. Not in list.txt.')
 
-	def from_mesh(self):
+	# instances: also export collection and geometry nodes instances
+	# evaluated: export meshes with modifiers applied, see joe_mesh_cache
+	def from_mesh(self, instances=False, evaluated=False):
+		self.meshes = joe_mesh_cache(evaluated)
 		objlist = bpy.context.scene.collection.all_objects
 		trackobject.set_groups()
 		for obj in objlist:
@@ -374,121 +780,281 @@ class joe_pack:
 				continue
 			if obj.name.startswith('~'):
 				continue
-			if not obj.data.loop_triangles:
-				obj.data.calc_loop_triangles()
-				if len(obj.data.loop_triangles) == 0:
-					print(obj.name + ' not exported. No faces.')
-					continue
-			if not obj.data.uv_layers:
-				print(obj.name + ' not exported. No texture coordinates.')
-				continue
-			image = None
-			mat = obj.data.materials[0]
-			if not mat.use_nodes:
-				print(obj.name + ' not exported. Material not using nodes.')
-				continue
-			nodes = mat.node_tree.nodes
-			bsdf = nodes.get('Principled BSDF')
-			bcol = bsdf.inputs['Base Color']
-			if bcol.is_linked:
-				image = bcol.links[0].from_node.image
-			if not image:
-				print(obj.name + ' not exported. No texture linked.')
-				continue
-			objname = obj.name
-			trackobj = trackobject().from_obj(obj, path.basename(image.filepath))
-			# override obj name
-			if len(trackobj.values[0]):
-				objname = trackobj.values[0]
-			# loader expects a joe file
-			if not objname.endswith('.joe'):
+			# an entry per material, named after it if there are several
+			mesh = self.meshes.get(obj)
+			images = joe_pack.export_images(mesh, obj.name, self.meshes.material_indices(mesh))
+			for material, mat, image in images:
+				objname = obj.name
+				trackobj = trackobject().from_obj(obj, path.basename(image.filepath))
+				# override obj name
+				if len(trackobj.values[0]):
+					objname = trackobj.values[0]
+				# loader expects a joe file
+				if objname.endswith('.joe'):
+					objname = objname[:-4]
+				if material is not None:
+					objname = objname + '-' + mat.name
+					trackobj.values[1] = path.basename(image.filepath)
 				objname = objname + '.joe'
 				trackobj.values[0] = objname
-			self.list[objname] = trackobj
-			self.joe[objname] = obj
-			self.maxstrlen = max(self.maxstrlen, len(objname))
+				self.list[objname] = trackobj
+				self.joe[objname] = obj
+				self.materials[objname] = material
+				self.maxstrlen = max(self.maxstrlen, len(objname))
+		if instances:
+			self.from_instances()
 		self.numobjs = len(self.joe)
 		return self
 
+	# instances generated by the depsgraph, each one becomes an entry named
+	# after its source object with its own list.txt record
+	def from_instances(self):
+		depsgraph = bpy.context.evaluated_depsgraph_get()
+		sources = {}
+		counts = {}
+		for inst in depsgraph.object_instances:
+			if not inst.is_instance or inst.object.type != 'MESH':
+				continue
+			# the instanced object, or the instancer for geometry nodes geometry
+			source = inst.instance_object.original
+			if source.name.startswith('~'):
+				continue
+			# instance data is only valid during iteration, extract all
+			# materials of each source geometry once in object space
+			key = inst.object.data.as_pointer()
+			if key not in sources:
+				mesh = inst.object.data
+				indices = joe_frame.material_indices(mesh)
+				images = joe_pack.export_images(mesh, source.name + ' instance', indices)
+				groups = joe_frame.extract_groups(inst.object, False, mesh, [image[0] for image in images], indices)
+				sources[key] = [image + (arrays,) for image, arrays in zip(images, groups)]
+			if not sources[key]:
+				continue
+			i = counts.get(source.name, 0)
+			while any(name in self.joe for name in joe_pack.instance_names(source.name, i, sources[key])):
+				i = i + 1
+			counts[source.name] = i + 1
+			names = joe_pack.instance_names(source.name, i, sources[key])
+			for objname, (material, mat, image, arrays) in zip(names, sources[key]):
+				trackobj = trackobject().from_obj(source, path.basename(image.filepath))
+				trackobj.values[0] = objname
+				if material is not None:
+					trackobj.values[1] = path.basename(image.filepath)
+				self.list[objname] = trackobj
+				self.joe[objname] = joe_instance((key, material), inst.matrix_world.copy(), arrays)
+				self.maxstrlen = max(self.maxstrlen, len(objname))
+
+	# entry names of instance i of a source, one per material
+	@staticmethod
+	def instance_names(name, i, materials):
+		name = name + '.' + str(i)
+		return [name + ('-' + mat.name if material is not None else '') + '.joe' for material, mat, image, arrays in materials]
+
+	# (material slot indices, material, texture image) of each material used by
+	# a mesh that can be exported, slots holding the same material are grouped,
+	# the indices are None if it uses a single material.
+	# indices: per triangle material indices if already read
+	@staticmethod
+	def export_images(mesh, name, indices=None):
+		if not mesh.loop_triangles:
+			mesh.calc_loop_triangles()
+			if len(mesh.loop_triangles) == 0:
+				print(name + ' not exported. No faces.')
+				return []
+		if not mesh.uv_layers:
+			print(name + ' not exported. No texture coordinates.')
+			return []
+		if not mesh.materials:
+			print(name + ' not exported. No material.')
+			return []
+		if indices is None:
+			indices = joe_frame.material_indices(mesh)
+		slots = {}
+		for i in np.unique(indices).tolist():
+			slots.setdefault(mesh.materials[i], []).append(i)
+		images = []
+		for mat, indices in slots.items():
+			matname = name if len(slots) == 1 else name + ' material slot ' + str(indices[0])
+			image = joe_pack.material_image(mat, matname)
+			if image:
+				images.append((tuple(indices) if len(slots) > 1 else None, mat, image))
+		return images
+
+	# texture image of a material, None if it can't be exported
+	@staticmethod
+	def material_image(mat, name):
+		if not mat:
+			print(name + ' not exported. No material.')
+			return None
+		if not mat.use_nodes:
+			print(name + ' not exported. Material not using nodes.')
+			return None
+		image = None
+		nodes = mat.node_tree.nodes
+		bsdf = nodes.get('Principled BSDF')
+		bcol = bsdf.inputs['Base Color']
+		if bcol.is_linked:
+			image = bcol.links[0].from_node.image
+		if not image:
+			print(name + ' not exported. No texture linked.')
+		return image
+
 	# fallback if no jpk
-	def load_joes(self, filename):
+	def load_joes(self, filename, names=None):
 		dir = path.dirname(filename)
 		for name in self.list:
+			if names is not None and name not in names:
+				continue
 			joe_path = path.join(dir, name)
 			file = open(joe_path, 'rb')
 			joe = joe_obj().load(file)
 			self.joe[name] = joe
 
-	def load(self, filename):
-		file = open(filename, 'rb')
-		# header
-		version = file.read(len(joe_pack.version))
-		if version != joe_pack.version:
-			raise Exception(filename + ' unknown jpk version: ' + str(version) + ' expected: ' + str(joe_pack.version))
-		data = file.read(joe_pack.bstruct.size)
-		v = joe_pack.bstruct.unpack(data)
-		self.numobjs = v[0]
-		self.maxstrlen = v[1]
-		# fat
-		fat = []
-		for i in range(self.numobjs):
-			data = file.read(joe_pack.bstruct.size)
-			v = joe_pack.bstruct.unpack(data)
-			offset = v[0]
-			length = v[1]
-			data = file.read(self.maxstrlen)
-			# strip trailing zeros
-			for i in range(self.maxstrlen):
-				if data[i] == 0:
-					data = data[:i]
-					break
-			name = data.decode('ascii')
-			fat.append((offset, length, name))
-		# data
-		for offset, length, name in fat:
-			pos = file.tell()
-			delta = offset - pos
-			if delta < 0:
-				print('Error reading: ', name, offset)
-				return
-			elif delta > 0:
-				file.read(delta)
-			joe = joe_obj().load(file)
-			self.joe[name] = joe
-		file.close()
-
-	def save(self, filename):
-		try:
-			file = open(filename, 'rb+')
-		except IOError:
-			file = open(filename, 'wb')
-		# header
-		file.write(self.version)
-		data = joe_pack.bstruct.pack(self.numobjs, self.maxstrlen)
-		file.write(data)
-		# allocate fat
-		fat_offset = file.tell()
-		for i in range(self.numobjs):
-			data = joe_pack.bstruct.pack(0, 0)
-			file.write(data)
-			name = util.fillz('', self.maxstrlen)
-			file.write(name.encode('ascii'))
-		# write data / build fat
-		fat = []
+	# workers: number of decoding threads, 0 for one per core
+	def load(self, filename, names=None, workers=0, custom_normals=False):
+		index = joe_pack_index(filename)
+		self.numobjs = index.numobjs
+		self.maxstrlen = index.maxstrlen
+		names = [name for name in index.names if names is None or name in names]
+		# entries sharing a payload share the decoded joe
+		unique = {}
+		for name in names:
+			unique.setdefault(index.offset(name), name)
+		# entries are independent views into the shared mapping,
+		# decode and cleanup them in parallel, meshes are built later
+		def decode(name):
+			joe = index.decode(name)
+			joe.frames[0].mesh_arrays(custom_normals)
+			return joe
+		with ThreadPoolExecutor(workers or cpu_count()) as pool:
+			joes = dict(zip(unique, pool.map(decode, unique.values())))
+		for name in names:
+			self.joe[name] = joes[index.offset(name)]
+
+	# workers: number of encoding processes, 1 encodes serially, 0 for one per core
+	# incremental: copy objects unchanged since the last incremental export
+	# from the existing pack, their content hashes are kept in a sidecar file
+	def save(self, filename, workers=1, compression=None, alignment=1, dedup=False, incremental=False):
+		hashfile = filename + '.hash'
+		hashes = {}
+		old = None
+		if incremental:
+			try:
+				with open(hashfile) as file:
+					old_hashes = json.load(file)
+				old = joe_pack_index(filename)
+			except Exception:
+				old_hashes = {}
+		elif path.exists(hashfile):
+			remove(hashfile)
+		# objects exceeding the int16 index range are split into several
+		# entries, the number of entries is unknown then
+		numobjs, maxstrlen = self.numobjs, self.maxstrlen
+		if any(joe_pack.may_split(obj, self.meshes.get(obj)) for obj in self.joe.values()):
+			numobjs, maxstrlen = None, None
+		parts = {}
+		workers = workers or cpu_count()
+		# linked duplicates share a mesh, it is extracted, filtered and split once
+		# in object space, each object then only transforms and encodes the result,
+		# instances are always handled this way
+		users = {}
 		for name, obj in self.joe.items():
-			offset = file.tell()
-			joe = joe_obj().from_mesh(obj)
-			joe.save(file)
-			length = file.tell() - offset
-			fat.append((offset, length, name))
-		# fill fat
-		file.seek(fat_offset)
-		for offset, length, name in fat:
-			data = joe_pack.bstruct.pack(offset, length)
-			file.write(data)
-			name = util.fillz(name, self.maxstrlen)
-			file.write(name.encode('ascii'))
-		file.close()
+			key = self.meshes.get(obj), self.materials.get(name)
+			users.setdefault(key, []).append(obj)
+		# all material groups of a mesh are extracted together on first use,
+		# in object space if it is shared, and handed out to their entries
+		groups = {}
+		for (mesh, material), objs in users.items():
+			if not isinstance(objs[0], joe_instance):
+				groups.setdefault((mesh, len(objs) == 1), []).append(material)
+		extracted = {}
+		def extract(obj, mesh, material, world):
+			if (mesh, material, world) not in extracted:
+				materials = groups[mesh, world]
+				indices = None
+				if materials != [None]:
+					indices = self.meshes.material_indices(mesh)
+				arrays = joe_frame.extract_groups(obj, world, mesh, materials, indices)
+				extracted.update(zip([(mesh, m, world) for m in materials], arrays))
+			return extracted.pop((mesh, material, world))
+		with util.executor(workers) as pool:
+			shared = {}
+			mesh_hashes = {}
+			for key, objs in users.items():
+				if isinstance(objs[0], joe_instance):
+					arrays = objs[0].arrays
+				elif len(objs) > 1:
+					arrays = extract(objs[0], *key, False)
+				else:
+					continue
+				if incremental:
+					mesh_hashes[key] = util.hash_arrays([arrays])
+				shared[key] = pool.submit(filter_joe, arrays)
+			shared = {key: future.result() for key, future in shared.items()}
+			# extract geometry on the main thread, encode in worker processes
+			def encode(name, obj):
+				mesh = self.meshes.get(obj)
+				key = mesh, self.materials.get(name)
+				if key in shared:
+					matrix = np.array(obj.matrix_world)
+					if incremental:
+						hash = util.hash_arrays([(matrix,)], mesh_hashes[key])
+				else:
+					frames = [extract(obj, *key, True)]
+					if incremental:
+						hash = util.hash_arrays(frames)
+				if incremental:
+					# hash, number of parts
+					hashes[name] = [hash, 1]
+					entry = old_hashes.get(name)
+					if old is not None and isinstance(entry, list) and entry[0] == hashes[name][0]:
+						names = joe_pack.part_names(name, entry[1])
+						if all(n in old for n in names):
+							return util.done([bytes(old.payload(n)) for n in names])
+				if key in shared:
+					return util.done(encode_instance(shared[key], matrix))
+				return pool.submit(encode_joe, frames)
+			def entries(futures):
+				for name, payloads in zip(self.joe, util.results(futures, 2 * workers)):
+					parts[name] = joe_pack.part_names(name, len(payloads))
+					if incremental:
+						hashes[name][1] = len(payloads)
+					yield from zip(parts[name], payloads)
+			futures = (encode(name, obj) for name, obj in self.joe.items())
+			# the old pack is still mapped, write next to it
+			outname = filename + '.tmp' if old is not None else filename
+			joe_pack_writer.write(outname, entries(futures), numobjs, maxstrlen, compression, alignment, dedup)
+		if old is not None:
+			old.close()
+			replace(outname, filename)
+		# split objects get a list entry per part, with the same properties
+		objlist = {}
+		for name, trackobj in self.list.items():
+			for partname in parts.get(name, [name]):
+				part = trackobject()
+				part.values = list(trackobj.values)
+				part.values[0] = partname
+				objlist[partname] = part
+		self.list = objlist
+		self.numobjs = len(objlist)
+		self.maxstrlen = max((len(name) for name in objlist), default=0)
+		if incremental:
+			with open(hashfile, 'w') as file:
+				json.dump(hashes, file)
+
+	# whether an object may exceed the int16 index range
+	@staticmethod
+	def may_split(obj, mesh):
+		if isinstance(obj, joe_instance):
+			return len(obj.arrays[0]) > 32767
+		return max(len(mesh.vertices) + len(mesh.loop_triangles), len(mesh.loops)) > 32767
+
+	# entry names of an object split into count parts
+	@staticmethod
+	def part_names(name, count):
+		if count == 1:
+			return [name]
+		return [name[:-4] + '-' + str(i) + '.joe' for i in range(count)]
 
 	def load_list(self, filename):
 		self.dirname = path.dirname(filename)
@@ -525,6 +1091,238 @@ class joe_pack:
 		file.close()
 
 
+# streaming objects.jpk writer, payloads are written as they are added and
+# the fat is filled on close, so only one payload needs to be in memory.
+# with unknown entry count or name length the fat size is unknown too,
+# payloads are spooled to a temporary file then.
+# alignment pads payload offsets to a byte boundary, the fat stays valid JPK01.
+# dedup writes identical payloads once, their fat entries share offset and length
+class joe_pack_writer:
+	def __init__(self, filename, numobjs=None, maxstrlen=None, compression=None, alignment=1, dedup=False):
+		self.file = open(filename, 'wb')
+		self.numobjs = numobjs
+		self.maxstrlen = maxstrlen
+		self.method = joe_pack.compressions[compression] if compression else 0
+		self.alignment = alignment
+		# payload hash: (offset, length, rawlength)
+		self.written = {} if dedup else None
+		self.fat = []
+		if numobjs is None or maxstrlen is None:
+			self.data = TemporaryFile()
+		else:
+			self.data = self.file
+			self.write_header()
+
+	# write all (name, payload) entries of an iterable
+	@staticmethod
+	def write(filename, entries, numobjs=None, maxstrlen=None, compression=None, alignment=1, dedup=False):
+		with joe_pack_writer(filename, numobjs, maxstrlen, compression, alignment, dedup) as jpk:
+			for name, payload in entries:
+				jpk.add(name, payload)
+
+	def write_header(self):
+		if self.method:
+			self.file.write(joe_pack.zversion)
+			data = joe_pack.zstruct.pack(self.numobjs, self.maxstrlen, self.method)
+			entry_size = joe_pack.zstruct.size + self.maxstrlen
+		else:
+			self.file.write(joe_pack.version)
+			data = joe_pack.bstruct.pack(self.numobjs, self.maxstrlen)
+			entry_size = joe_pack.bstruct.size + self.maxstrlen
+		self.file.write(data)
+		# allocate fat
+		self.fat_offset = self.file.tell()
+		self.file.write(bytes(self.numobjs * entry_size))
+
+	def add(self, name, payload):
+		if self.data is self.file:
+			if len(self.fat) == self.numobjs:
+				raise Exception('More than ' + str(self.numobjs) + ' objects added to jpk')
+			if len(name) > self.maxstrlen:
+				raise Exception(name + ' longer than ' + str(self.maxstrlen) + ' characters')
+		if self.written is not None:
+			key = sha1(payload).digest()
+			entry = self.written.get(key)
+			if entry:
+				self.fat.append((*entry, name))
+				return
+		rawlength = len(payload)
+		if self.method:
+			payload = joe_pack.compressors[self.method].compress(payload)
+		self.pad(self.data)
+		offset = self.data.tell()
+		self.data.write(payload)
+		self.fat.append((offset, len(payload), rawlength, name))
+		if self.written is not None:
+			self.written[key] = (offset, len(payload), rawlength)
+
+	# zero fill file up to next alignment boundary
+	def pad(self, file):
+		file.write(bytes(-file.tell() % self.alignment))
+
+	def close(self):
+		base = 0
+		if self.data is not self.file:
+			# spooled offsets are relative to the first payload
+			self.numobjs = len(self.fat)
+			self.maxstrlen = max((len(entry[-1]) for entry in self.fat), default=0)
+			self.write_header()
+			self.pad(self.file)
+			base = self.file.tell()
+			self.data.seek(0)
+			copyfileobj(self.data, self.file)
+			self.data.close()
+		elif len(self.fat) != self.numobjs:
+			raise Exception(str(len(self.fat)) + ' of ' + str(self.numobjs) + ' objects added to jpk')
+		# fill fat
+		self.file.seek(self.fat_offset)
+		for offset, length, rawlength, name in self.fat:
+			if self.method:
+				data = joe_pack.zstruct.pack(base + offset, length, rawlength)
+			else:
+				data = joe_pack.bstruct.pack(base + offset, length)
+			self.file.write(data)
+			name = util.fillz(name, self.maxstrlen)
+			self.file.write(name.encode('ascii'))
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		if type is None:
+			self.close()
+		else:
+			if self.data is not self.file:
+				self.data.close()
+			self.file.close()
+
+
+# header and fat of a mapped objects.jpk, entries are decompressed and decoded
+# on first access and kept in a lru cache bounded by the memory they hold,
+# plain entries decode to views into the mapping without a copy
+class joe_pack_index:
+	def __init__(self, filename, cache_size=256 << 20):
+		# decoded joes keep views into the mapping alive
+		with open(filename, 'rb') as file:
+			self.map = mmap(file.fileno(), 0, access=ACCESS_READ)
+		self.buffer = memoryview(self.map)
+		self.filename = filename
+		# offset: (joe, size), decoding threads share it
+		self.cache = OrderedDict()
+		self.cache_size = cache_size
+		self.cached = 0
+		self.lock = Lock()
+		# header
+		buffer = self.buffer
+		version = bytes(buffer[:len(joe_pack.version)])
+		pos = len(version)
+		if version == joe_pack.version:
+			fat_struct = joe_pack.bstruct
+		elif version == joe_pack.zversion:
+			fat_struct = joe_pack.zstruct
+		else:
+			raise Exception(filename + ' unknown jpk version: ' + str(version) + ' expected: ' + str(joe_pack.version))
+		if pos + fat_struct.size > len(buffer):
+			raise Exception(filename + ' truncated jpk header')
+		v = fat_struct.unpack_from(buffer, pos)
+		self.method = 0
+		if version == joe_pack.zversion:
+			self.method = v[2]
+			if self.method not in joe_pack.compressors:
+				raise Exception(filename + ' unknown jpk compression: ' + str(self.method))
+		self.numobjs = v[0]
+		self.maxstrlen = v[1]
+		pos += fat_struct.size
+		if self.numobjs < 0 or self.maxstrlen < 0 or \
+			pos + self.numobjs * (fat_struct.size + self.maxstrlen) > len(buffer):
+			raise Exception(filename + ' truncated jpk fat of ' + str(self.numobjs) + ' entries')
+		# fat, name: (offset, length, uncompressed length)
+		self.entries = {}
+		for i in range(self.numobjs):
+			v = fat_struct.unpack_from(buffer, pos)
+			offset = v[0]
+			length = v[1]
+			rawlength = v[2] if self.method else length
+			pos += fat_struct.size
+			# strip trailing zeros
+			data = bytes(buffer[pos:pos + self.maxstrlen]).split(b'\0', 1)[0]
+			pos += self.maxstrlen
+			name = data.decode('ascii')
+			self.entries[name] = (offset, length, rawlength)
+		for name, (offset, length, rawlength) in self.entries.items():
+			if offset < pos or offset + length > len(buffer):
+				raise Exception(filename + ' error reading: ' + name + ' at ' + str(offset))
+
+	@property
+	def names(self):
+		return list(self.entries)
+
+	def offset(self, name):
+		return self.entries[name][0]
+
+	def length(self, name):
+		return self.entries[name][1]
+
+	def rawlength(self, name):
+		return self.entries[name][2]
+
+	# joe bytes of an entry, no copy unless compressed
+	def payload(self, name):
+		offset, length, rawlength = self.entries[name]
+		data = self.buffer[offset:offset + length]
+		if self.method:
+			data = joe_pack.compressors[self.method].decompress(data)
+			if len(data) != rawlength:
+				raise Exception(self.filename + ' error decompressing: ' + name)
+		return data
+
+	# decoded entry, cached by offset as entries may share payloads.
+	# the decoded joe is shared, callers must not modify it
+	def decode(self, name):
+		offset = self.entries[name][0]
+		with self.lock:
+			if offset in self.cache:
+				self.cache.move_to_end(offset)
+				return self.cache[offset][0]
+		joe = joe_obj().unpack_from(self.payload(name))
+		size = self.heap_size(name, joe)
+		with self.lock:
+			if offset in self.cache:
+				return self.cache[offset][0]
+			self.cache[offset] = joe, size
+			self.cached += size
+			while self.cached > self.cache_size and len(self.cache) > 1:
+				old, oldsize = self.cache.popitem(last=False)[1]
+				self.cached -= oldsize
+		return joe
+
+	# memory held by a decoded entry besides the mapping, the inflated
+	# payload of compressed entries, arrays copied while decoding otherwise
+	def heap_size(self, name, joe):
+		if self.method:
+			return self.rawlength(name)
+		size = 0
+		for frame in joe.frames:
+			for values in (frame.faces, frame.verts, frame.normals, frame.texcoords):
+				if values.flags.owndata:
+					size += values.nbytes
+		return size
+
+	# unmap file, fails while decoded joes or payload views still reference it
+	def close(self):
+		self.cache.clear()
+		self.cached = 0
+		self.buffer.release()
+		self.map.close()
+
+	def __contains__(self, name):
+		return name in self.entries
+
+	def __len__(self):
+		return len(self.entries)
+
+
 class trackobject:
 	names = ('model', 'texture', 'mipmap', 'lighting', 'skybox', 'blend',\
 			'bump length', 'bump amplitude', 'drivable', 'collidable',\
@@ -657,19 +1455,17 @@ class roads:
 	@staticmethod
 	def save(path):
 		file = open(path, 'w')
-		meshes = []
+		objects = []
 		i = 0
 		while 'road.' + str(i) in bpy.data.objects:
-			obj = bpy.data.objects['road.' + str(i)]
-			mesh = obj.data
-			if obj.matrix_world != Matrix.Identity(4):
-				mesh = obj.data.copy()
-				mesh.transform(obj.matrix_world)
-			meshes.append(mesh)
+			objects.append(bpy.data.objects['road.' + str(i)])
 			i = i + 1
-		file.write(str(len(meshes)) + '\n\n')
-		for m in meshes:
-			roads.save_road(file, m)
+		file.write(str(len(objects)) + '\n\n')
+		for obj in objects:
+			matrix = None
+			if obj.matrix_world != Matrix.Identity(4):
+				matrix = obj.matrix_world
+			roads.save_road(file, obj.data, matrix)
 
 	@staticmethod
 	def load_road(file, name):
@@ -716,9 +1512,15 @@ class roads:
 		object = bpy.data.objects.new(name, mesh)
 		bpy.context.scene.collection.objects.link(object)
 
+	# matrix: optional world transform applied to the vertices
 	@staticmethod
-	def save_road(file, mesh):
+	def save_road(file, mesh, matrix=None):
 		patchnum = int(len(mesh.vertices) / 4 - 1)
+		# world space vertices, the mesh itself is left untouched
+		co = util.foreach_get(mesh.vertices, 'co', np.float32, 3)
+		if matrix is not None:
+			co = util.transform(co, np.array(matrix))
+		verts = [Vector(v) for v in co.tolist()]
 		#print('patches from facenum ' + str(len(mesh.loop_triangles) / 3))
 		#print('patches from vertnum ' + str(patchnum))
 		road = [None] * 16 * patchnum
@@ -737,9 +1539,9 @@ class roads:
 				ri = patchid * 16 + pointid
 				vi = mesh.loops[ls + n].vertex_index
 				if patchid < patchnum:
-					road[ri] = mesh.vertices[vi].co
+					road[ri] = verts[vi]
 				if patchid > 0:
-					road[ri - 4] = mesh.vertices[vi].co
+					road[ri - 4] = verts[vi]
 		# debug
 		#for i, p in enumerate(road):
 		#	if p:
@@ -879,21 +1681,139 @@ class track:
 
 
 class util:
-	# helper class to filter duplicates
-	class indexed_set(object):
-		def __init__(self):
-			self.map = {}
-			self.list = []
-		def get(self, ob):
-			# using float as key in dict
-			fixed = tuple(round(n, 5) for n in ob)
-			if not fixed in self.map:
-				ni = len(self.list)
-				self.map[fixed] = ni
-				self.list.append(fixed)
-			else:
-				ni = self.map[fixed]
-			return ni
+	# filter duplicate rows of a (num, width) array, compared at 5 decimals.
+	# returns the rounded unique rows in order of first appearance
+	# and the index of each input row into them
+	@staticmethod
+	def unique_rows(values, decimals=5):
+		values = np.asarray(values, np.float64)
+		values = values.reshape(len(values), -1 if len(values) else values.shape[-1])
+		# compare as integers, this also makes -0.0 and 0.0 equal
+		keys = np.rint(values * 10.0 ** decimals).astype(np.int64)
+		first, inverse = util.unique_index(keys)
+		return np.round(values[first], decimals), inverse
+
+	# unique rows of an integer (num, width) array, returns the input index
+	# of each unique row in order of first appearance
+	# and the index of each input row into them
+	@staticmethod
+	def unique_index(keys):
+		if len(keys) == 0:
+			return np.zeros(0, np.intp), np.zeros(0, np.intp)
+		# stable sort, the first row of each run of equal keys is its first appearance
+		order = np.lexsort(keys.T[::-1])
+		keys = keys[order]
+		new = np.empty(len(keys), bool)
+		new[0] = True
+		np.any(keys[1:] != keys[:-1], axis=1, out=new[1:])
+		first = order[new]
+		# number unique rows by first appearance
+		rank = np.empty(len(first), np.intp)
+		rank[np.argsort(first)] = np.arange(len(first))
+		inverse = np.empty(len(keys), np.intp)
+		inverse[order] = rank[np.cumsum(new) - 1]
+		return np.sort(first), inverse
+
+	# consecutive face ranges referencing at most limit distinct
+	# vertex, normal and texcoord indices each
+	@staticmethod
+	def split_ranges(faces, limit):
+		def fits(start, end):
+			f = faces[start:end]
+			return all(len(np.unique(f[:, i:i + 3])) <= limit for i in (0, 3, 6))
+		ranges = []
+		start = 0
+		while start < len(faces):
+			# a third of limit faces always fits, gallop past the
+			# largest fitting end, then bisect
+			step = limit // 3
+			lo = min(start + step, len(faces))
+			hi = min(lo + step, len(faces))
+			while hi > lo and fits(start, hi):
+				lo = hi
+				hi = min(hi + step, len(faces))
+				step *= 2
+			while hi - lo > 1:
+				mid = (lo + hi) // 2
+				if fits(start, mid):
+					lo = mid
+				else:
+					hi = mid
+			ranges.append((start, lo))
+			start = lo
+		return ranges
+
+	# (num, width) array of a collection attribute, read in bulk
+	@staticmethod
+	def foreach_get(collection, attr, dtype, width=1):
+		values = np.empty(len(collection) * width, dtype)
+		collection.foreach_get(attr, values)
+		return values.reshape(-1, width) if width > 1 else values
+
+	# transform (num, 3) positions by a 4x4 matrix
+	@staticmethod
+	def transform(co, matrix):
+		return (co @ matrix[:3, :3].T + matrix[:3, 3]).astype(np.float32)
+
+	# transform (num, 3) normals by the inverse transpose of a 4x4 matrix.
+	# uses the adjugate, the inverse up to scale, which also exists
+	# for matrices flattening an axis
+	@staticmethod
+	def transform_normals(normals, matrix):
+		m = matrix[:3, :3]
+		adjugate = np.array((np.cross(m[1], m[2]), np.cross(m[2], m[0]), np.cross(m[0], m[1]))).T
+		if np.linalg.det(m) < 0:
+			adjugate = -adjugate
+		normals = normals @ adjugate
+		length = np.linalg.norm(normals, axis=1, keepdims=True)
+		return (normals / np.maximum(length, 1e-12)).astype(np.float32)
+
+	# pool for cpu bound work, forked worker processes on linux as spawned
+	# ones can't import bpy, threads otherwise, in the calling thread for one worker
+	@staticmethod
+	def executor(workers=0):
+		workers = workers or cpu_count()
+		if workers == 1:
+			return util.serial()
+		# forking the multithreaded blender process is unsafe on macos
+		if sys.platform.startswith('linux') and 'fork' in get_all_start_methods():
+			return ProcessPoolExecutor(workers, mp_context=get_context('fork'))
+		return ThreadPoolExecutor(workers)
+
+	# executor running each job on submit in the calling thread
+	class serial(Executor):
+		def submit(self, fn, *args, **kwargs):
+			return util.done(fn(*args, **kwargs))
+
+	# ordered results of a generator of futures keeping at most limit in flight,
+	# so the generator runs no further ahead than results are consumed
+	@staticmethod
+	def results(futures, limit):
+		pending = deque()
+		for future in futures:
+			pending.append(future)
+			if len(pending) >= limit:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
+
+	# future holding an already known result
+	@staticmethod
+	def done(result):
+		future = Future()
+		future.set_result(result)
+		return future
+
+	# content hash of per frame export arrays,
+	# base: hash of shared content the arrays are applied to
+	@staticmethod
+	def hash_arrays(frames, base=''):
+		hash = sha1((str(bl_info['version']) + base).encode())
+		for arrays in frames:
+			for a in arrays:
+				hash.update(str(a.shape).encode())
+				hash.update(np.ascontiguousarray(a))
+		return hash.hexdigest()
 
 	# fill trailing zeroes
 	@staticmethod
@@ -908,6 +1828,11 @@ class ExportJoe(bpy.types.Operator, ExportHelper):
 	filter_glob: StringProperty(
 			default='*.joe',
 			options={'HIDDEN'})
+	frames: IntProperty(
+			name='Frames',
+			description='Number of animation frames to export, starting at frame 0',
+			default=1,
+			min=1)
 
 	def __init__(self):
 		try:
@@ -924,10 +1849,13 @@ class ExportJoe(bpy.types.Operator, ExportHelper):
 		if object.type != 'MESH':
 			raise NameError('Selected object must be a mesh!')
 		try:
-			file = open(filepath, 'wb')
-			joe = joe_obj().from_mesh(object)
-			joe.save(file)
-			file.close()
+			joe = joe_obj().from_mesh(object, self.frames)
+			joes = joe.split()
+			filepaths = joe_pack.part_names(filepath, len(joes))
+			for filepath, joe in zip(filepaths, joes):
+				file = open(filepath, 'wb')
+				joe.save(file)
+				file.close()
 		finally:
 			self.report({'INFO'},  object.name + ' exported')
 		return {'FINISHED'}
@@ -944,6 +1872,10 @@ class ImportJoe(bpy.types.Operator, ImportHelper):
 	filter_glob: StringProperty(
 		default='*.joe',
 		options={'HIDDEN'})
+	custom_normals: BoolProperty(
+		name='Custom normals',
+		description='Keep shared vertices and import normals as custom split normals instead of splitting vertices at hard edges',
+		default=False)
 
 	def execute(self, context):
 		props = self.properties
@@ -951,7 +1883,7 @@ class ImportJoe(bpy.types.Operator, ImportHelper):
 		try:
 			file = open(filepath, 'rb')
 			joe = joe_obj().load(file)
-			joe.to_mesh(bpy.path.basename(filepath))
+			joe.to_mesh(bpy.path.basename(filepath), custom_normals=self.custom_normals)
 		finally:
 			self.report({'INFO'},  filepath + ' imported')
 		return {'FINISHED'}
@@ -995,11 +1927,45 @@ class ExportJpk(bpy.types.Operator, ExportHelper):
 			name='Export objects (objects.jpk)',
 			description='Export track objects as JPK',
 			default=True)
+	processes: IntProperty(
+			name='Encoding processes',
+			description='Number of processes encoding objects, 1 encodes serially, 0 for one per core. Processes are forked on Linux only, threads are used elsewhere',
+			default=1,
+			min=0)
+	compression: EnumProperty(
+			name='Compression',
+			description='Compress objects, the game only reads uncompressed packs',
+			items=(('NONE', 'None', 'Plain JPK01 pack'),
+				('ZLIB', 'zlib', 'Fast zlib compressed JPZ01 pack'),
+				('LZMA', 'lzma', 'Small lzma compressed JPZ01 pack')),
+			default='NONE')
+	align: BoolProperty(
+			name='Align objects',
+			description='Start each object on a 16 byte boundary',
+			default=False)
+	dedup: BoolProperty(
+			name='Share identical objects',
+			description='Store identical objects once, referenced by several entries',
+			default=False)
+	incremental: BoolProperty(
+			name='Incremental',
+			description='Only encode objects changed since the last incremental export',
+			default=False)
+	instances: BoolProperty(
+			name='Export instances',
+			description='Export collection and geometry nodes instances, each as its own object',
+			default=False)
+	evaluated: BoolProperty(
+			name='Apply modifiers',
+			description='Export meshes with modifiers and shape keys applied, leaving the objects untouched',
+			default=False)
 
 	def execute(self, context):
 		props = self.properties
 		filepath = bpy.path.ensure_ext(self.filepath, self.filename_ext)
-		joe_pack.write(filepath, self.export_list, self.ExportJpk)
+		compression = self.compression if self.compression != 'NONE' else None
+		alignment = 16 if self.align else 1
+		joe_pack.write(filepath, self.export_list, self.ExportJpk, self.processes, compression, alignment, self.dedup, self.incremental, self.instances, self.evaluated)
 		return {'FINISHED'}
 
 	def invoke(self, context, event):
@@ -1014,12 +1980,46 @@ class ImportJpk(bpy.types.Operator, ImportHelper):
 	filter_glob: StringProperty(
 		default='*.jpk',
 		options={'HIDDEN'})
+	threads: IntProperty(
+		name='Decoding threads',
+		description='Number of threads decoding objects, 0 for one per core',
+		default=0,
+		min=0)
+	custom_normals: BoolProperty(
+		name='Custom normals',
+		description='Keep shared vertices and import normals as custom split normals instead of splitting vertices at hard edges',
+		default=False)
 
 	def execute(self, context):
 		props = self.properties
 		filepath = bpy.path.ensure_ext(self.filepath, self.filename_ext)
-		jpk = joe_pack.read(filepath)
-		jpk.to_mesh()
+		jpk = joe_pack.read(filepath, workers=self.threads, custom_normals=self.custom_normals)
+		jpk.to_mesh(self.custom_normals)
+		return {'FINISHED'}
+
+
+class ReportJpk(bpy.types.Operator, ImportHelper):
+	bl_idname = 'import.jpk_report'
+	bl_label = 'Report JPK sizes'
+	filename_ext = '.jpk'
+	filter_glob: StringProperty(
+		default='*.jpk;*.joe',
+		options={'HIDDEN'})
+
+	def execute(self, context):
+		props = self.properties
+		filepath = self.filepath
+		if not path.exists(filepath):
+			filepath = path.dirname(filepath)
+		try:
+			report = joe_pack.scan_report(filepath)
+		except Exception as e:
+			self.report({'ERROR'}, str(e))
+			return {'CANCELLED'}
+		print(report)
+		text = bpy.data.texts.new(path.basename(filepath) + ' report')
+		text.write(report)
+		self.report({'INFO'}, 'Report written to text ' + text.name)
 		return {'FINISHED'}
 
 
@@ -1030,12 +2030,16 @@ class ImportJoeList(bpy.types.Operator, ImportHelper):
 	filter_glob: StringProperty(
 		default='*.txt',
 		options={'HIDDEN'})
+	custom_normals: BoolProperty(
+		name='Custom normals',
+		description='Keep shared vertices and import normals as custom split normals instead of splitting vertices at hard edges',
+		default=False)
 
 	def execute(self, context):
 		props = self.properties
 		filepath = bpy.path.ensure_ext(self.filepath, self.filename_ext)
-		jpk = joe_pack.read(filepath)
-		jpk.to_mesh()
+		jpk = joe_pack.read(filepath, custom_normals=self.custom_normals)
+		jpk.to_mesh(self.custom_normals)
 		return {'FINISHED'}
 
 
@@ -1201,6 +2205,10 @@ def menu_import_jpk(self, context):
 	self.layout.operator(ImportJpk.bl_idname, text = 'VDrift JPK (.jpk)')
 
 
+def menu_report_jpk(self, context):
+	self.layout.operator(ReportJpk.bl_idname, text = 'VDrift JPK/JOE Size Report')
+
+
 def menu_import_joe_list(self, context):
 	self.layout.operator(ImportJoeList.bl_idname, text = 'VDrift Track Objects (list.txt)')
 
@@ -1236,6 +2244,7 @@ classes = (
 	ImportCar,
 	ImportImage,
 	ImportJoeList,
+	ReportJpk,
 )
 
 def register():
@@ -1253,6 +2262,7 @@ def register():
 	bpy.types.TOPBAR_MT_file_import.append(menu_import_car)
 	bpy.types.TOPBAR_MT_file_import.append(menu_import_image)
 	bpy.types.TOPBAR_MT_file_import.append(menu_import_joe_list)
+	bpy.types.TOPBAR_MT_file_import.append(menu_report_jpk)
 
 def unregister():
 	for c in classes:
@@ -1269,6 +2279,13 @@ def unregister():
 	bpy.types.TOPBAR_MT_file_import.remove(menu_import_car)
 	bpy.types.TOPBAR_MT_file_import.remove(menu_import_image)
 	bpy.types.TOPBAR_MT_file_import.remove(menu_import_joe_list)
+	bpy.types.TOPBAR_MT_file_import.remove(menu_report_jpk)
 
+# blender -b -P vdrift.py -- scan <objects.jpk | file.joe | directory> ...
 if __name__ == '__main__':
-	register()
+	args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+	if args[:1] == ['scan']:
+		for arg in args[1:]:
+			print(joe_pack.scan_report(arg))
+	else:
+		register()